@@ -1,11 +1,145 @@
 import streamlit as st
-import os
-import tempfile
-from openai import OpenAI
-import guitarpro
+import functools
+import io
+import re
+import time
+
+# Measure header attributes that may carry text annotations, in priority order
+_HEADER_TEXT_ATTRS = ('text', 'direction', 'annotation', 'comment')
+
+# Keywords used to classify measure text annotations into song sections (lowercased once)
+_SECTION_KEYWORDS = {k: tuple(s.lower() for s in v) for k, v in {
+    'VERSE': ['verse', 'v1', 'v2', 'v3', 'v4', 'verse 1', 'verse 2'],
+    'CHORUS': ['chorus', 'ch', 'chor', 'refrain'],
+    'BRIDGE': ['bridge', 'br', 'middle eight'],
+    'INTRO': ['intro', 'introduction'],
+    'OUTRO': ['outro', 'ending', 'coda', 'end'],
+    'SOLO': ['solo', 'instrumental', 'inst', 'guitar solo', 'bass solo'],
+    'PRE-CHORUS': ['pre-chorus', 'pre chorus', 'prechorus', 'pre-verse'],
+    'INTERLUDE': ['interlude', 'break', 'intermezzo'],
+}.items()}
+
+# Matches runs of non-ASCII characters (emoji etc.) replaced by sanitize_for_api
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7F]+')
+
+# Pitch class names (prefer sharps for simplicity) and their ABC spellings
+_PITCH_NAMES = ('C','C#','D','D#','E','F','F#','G','G#','A','A#','B')
+_ABC_NOTE_NAMES = ("C","^C","D","^D","E","F","^F","G","^G","A","^A","B")
+
+# Key names by number of sharps (positive) or flats (negative)
+_MAJOR_KEYS = {0:"C", 1:"G", 2:"D", 3:"A", 4:"E", 5:"B", 6:"F#", 7:"C#",
+               -1:"F", -2:"Bb", -3:"Eb", -4:"Ab", -5:"Db", -6:"Gb", -7:"Cb"}
+_MINOR_KEYS = {0:"Am", 1:"Em", 2:"Bm", 3:"F#m", 4:"C#m", 5:"G#m", 6:"D#m", 7:"A#m",
+               -1:"Dm", -2:"Gm", -3:"Cm", -4:"Fm", -5:"Bbm", -6:"Ebm", -7:"Abm"}
+
+# Streamed chat responses are re-rendered after this many chunks or seconds
+_STREAM_FLUSH_CHUNKS = 8
+_STREAM_FLUSH_SECONDS = 0.05
+
+# Largest ABC text (in characters) rendered inline with a copy button
+_MAX_INLINE_ABC = 200000
+
+# Matches a line of a bar containing only rests, ending in a bar line or, for long
+# bars split over several lines, a line continuation (e.g. "z4 z4 z8 |")
+_REST_BAR_RE = re.compile(r'^\s*(?:z\d*(?:/\d+)?\s+)*[|\\]$')
+
+# Note effects in output order as (attribute, marker, is_obj): object-valued
+# effects count when set (not None), the rest when truthy
+_NOTE_EFFECT_FLAGS = (
+    ('bend', 'b', True),
+    ('hammer', 'ho', False),
+    ('harmonic', 'h', True),
+    ('slides', 's', False),
+    ('vibrato', 'v', False),
+    ('palmMute', 'pm', False),
+    ('staccato', 'st', False),
+    ('tapping', 't', False),
+    ('tremoloPicking', 'tr', False),
+)
 
-def process_guitar_pro(file_path):
-    # Parse the GuitarPro file into a Song object
+# Helper to convert MIDI pitch number to ABC note string
+@functools.lru_cache(maxsize=256)
+def midi_to_abc(pitch):
+    name = _ABC_NOTE_NAMES[pitch % 12] # e.g., 61 % 12 = 1 -> "^C" (C#)
+    octave = pitch // 12 - 1           # MIDI octave (C4=60 gives 4-1=3, but C4 is middle C in ABC)
+    base_octave = 4                    # Octave number that corresponds to no comma or apostrophe (C4-B4)
+    # Determine letter case and octave markers
+    letter = name[1] if name.startswith('^') else name[0]  # base letter (A-G)
+    if octave >= base_octave:
+        # Uppercase for octave 4, lowercase for 5 and above
+        abc_letter = letter.upper() if octave == base_octave else letter.lower()
+        if octave > base_octave + 1:  # add apostrophes for octave > 5
+            abc_letter += "'" * (octave - 5)
+    else:
+        # Octave below 4: uppercase with commas
+        abc_letter = letter.upper()
+        abc_letter += "," * (base_octave - octave)
+    # Prepend accidental if needed
+    return ("^" + abc_letter) if name.startswith('^') else abc_letter
+
+# Chord suffixes keyed by intervals above the root: power chords (dyads only
+# label the 5th), triads, and 4-note chords (sevenths, sixths)
+_CHORD_SHAPES = {
+    (7,): "5",
+    (4,7): "maj", (3,7): "min", (3,6): "dim", (4,8): "aug", (2,7): "sus2", (5,7): "sus4",
+    (4,7,10): "7", (3,7,10): "min7", (4,7,11): "maj7", (3,6,10): "min7b5",
+    (3,6,9): "dim7", (4,7,9): "6", (3,7,9): "min6",
+}
+
+# Helper to identify chord name from a set of pitches
+def identify_chord(pitches):
+    # Normalize to sorted unique pitch classes so equal chord shapes share a cache entry
+    return _identify_chord_pcs(tuple(sorted({p % 12 for p in pitches})))
+
+@functools.lru_cache(maxsize=4096)
+def _identify_chord_pcs(pcs):
+    if not pcs:
+        return None
+    # Use lowest note as tentative root
+    root = pcs[0]
+    rel = sorted(((pc - root) % 12) for pc in pcs)  # relative pitches from root
+    root_name = _PITCH_NAMES[root]
+    # Recognize common chord intervals (skip 0 which is root); more complex chords
+    # (9ths, etc.) or unrecognized patterns return None
+    suffix = _CHORD_SHAPES.get(tuple(rel[1:]))
+    return f"{root_name}{suffix}" if suffix else None
+
+# Helper to classify an annotation into a song section; the same labels recur
+# throughout a song, so results are cached and the text is lowercased only once
+@functools.lru_cache(maxsize=256)
+def _section_type(section_text):
+    section_text_lo = section_text.lower()
+    for type_name, keywords in _SECTION_KEYWORDS.items():
+        if any(keyword in section_text_lo for keyword in keywords):
+            return type_name
+    return None
+
+# Helper to compute the ABC length suffix (relative to L:1/16) for a beat duration
+@functools.lru_cache(maxsize=64)
+def _dur_suffix(dur, dotted):
+    length_multiplier = 16 / dur if dur != 0 else 16
+    if dotted:
+        length_multiplier *= 1.5
+
+    if length_multiplier == 1:
+        return ""
+    elif length_multiplier < 1:
+        return f"/{int(1/length_multiplier)}"
+    else:
+        return f"{int(length_multiplier)}"
+
+# Helper to append a beat's duration to a rest, chord or note token
+def _fmt_dur(tok, duration):
+    if duration:
+        return tok + _dur_suffix(duration.value, bool(duration.isDotted))
+    return tok + _dur_suffix(4, False)
+
+def stream_guitar_pro(file_path):
+    # Yields the converted text in chunks: the song header first, then one chunk per track
+    # Imported lazily so app startup doesn't pay for it until a file is converted
+    import guitarpro
+
+    # Parse the GuitarPro file (a path or binary file-like object) into a Song object
     song = guitarpro.parse(file_path)
 
     # Extract global metadata from the song
@@ -38,11 +172,7 @@ def process_guitar_pro(file_path):
                         break
         # Map sharps/flats count to key name
         if 'sharps' in locals() and sharps is not None:
-            major_map = {0:"C", 1:"G", 2:"D", 3:"A", 4:"E", 5:"B", 6:"F#", 7:"C#",
-                         -1:"F", -2:"Bb", -3:"Eb", -4:"Ab", -5:"Db", -6:"Gb", -7:"Cb"}
-            minor_map = {0:"Am", 1:"Em", 2:"Bm", 3:"F#m", 4:"C#m", 5:"G#m", 6:"D#m", 7:"A#m",
-                         -1:"Dm", -2:"Gm", -3:"Cm", -4:"Fm", -5:"Bbm", -6:"Ebm", -7:"Abm"}
-            key_text = minor_map[sharps] if is_minor else major_map[sharps]
+            key_text = _MINOR_KEYS[sharps] if is_minor else _MAJOR_KEYS[sharps]
 
     # Get initial time signature (from first measure)
     if song.tracks and song.tracks[0].measures:
@@ -63,114 +193,45 @@ def process_guitar_pro(file_path):
     song_notice = getattr(song, 'notice', '')
     song_subtitles = getattr(song, 'subtitles', [])
 
-    # Prepare output lines
-    output = []
+    # Prepare output buffer
+    buf = io.StringIO()
+    out = buf.write
     # Document custom notation in the output for user clarity
-    output.append("Custom ABC notation enhancements:")
-    output.append("- Chords are labeled in brackets (e.g. [C5] for C power chord)")
-    output.append("- Guitar techniques are noted with separate parentheses:")
-    output.append("  - **(b)** for a pitch bend")
-    output.append("  - **(h)** for a harmonic")
-    output.append("  - **(s)** for a slide between notes")
-    output.append("  - **(ho)** for a hammer-on")
-    output.append("  - **(po)** for a pull-off")
-    output.append("- Song sections are marked with: {SECTION: name}")
-    output.append("- Lyrics are included as: \"Lyric text\"\n")
+    out("Custom ABC notation enhancements:\n")
+    out("- Chords are labeled in brackets (e.g. [C5] for C power chord)\n")
+    out("- Guitar techniques are noted with separate parentheses:\n")
+    out("  - **(b)** for a pitch bend\n")
+    out("  - **(h)** for a harmonic\n")
+    out("  - **(s)** for a slide between notes\n")
+    out("  - **(ho)** for a hammer-on\n")
+    out("  - **(po)** for a pull-off\n")
+    out("- Song sections are marked with: {SECTION: name}\n")
+    out("- Lyrics are included as: \"Lyric text\"\n\n")
 
     # Enhanced song metadata
-    output.append(f"Title: {song_title}")
+    out(f"Title: {song_title}\n")
     if song_artist != 'Unknown Artist':
-        output.append(f"Artist: {song_artist}")
+        out(f"Artist: {song_artist}\n")
     if song_album != 'Unknown Album':
-        output.append(f"Album: {song_album}")
+        out(f"Album: {song_album}\n")
     if song_composer != 'Unknown Composer':
-        output.append(f"Composer: {song_composer}")
+        out(f"Composer: {song_composer}\n")
     if song_copyright:
-        output.append(f"Copyright: {song_copyright}")
+        out(f"Copyright: {song_copyright}\n")
     if song_notice:
-        output.append(f"Notes: {song_notice}")
+        out(f"Notes: {song_notice}\n")
     if song_instructions:
-        output.append(f"Instructions: {song_instructions}")
+        out(f"Instructions: {song_instructions}\n")
     if song_subtitles:
-        output.append(f"Subtitles: {' / '.join(song_subtitles)}")
-    output.append(f"Tempo: {tempo} BPM")
+        out(f"Subtitles: {' / '.join(song_subtitles)}\n")
+    out(f"Tempo: {tempo} BPM\n")
     # Present key in text (e.g., C major or A minor)
     if key_text.endswith("m"):
-        output.append(f"Key: {key_text[:-1]} minor")
+        out(f"Key: {key_text[:-1]} minor\n")
     else:
-        output.append(f"Key: {key_text} major")
-    output.append(f"Time Signature: {num}/{den}\n")
-
-    # Helper to convert MIDI pitch number to ABC note string
-    note_names = ["C","^C","D","^D","E","F","^F","G","^G","A","^A","B"]
-    def midi_to_abc(pitch):
-        name = note_names[pitch % 12]      # e.g., 61 % 12 = 1 -> "^C" (C#)
-        octave = pitch // 12 - 1           # MIDI octave (C4=60 gives 4-1=3, but C4 is middle C in ABC)
-        base_octave = 4                    # Octave number that corresponds to no comma or apostrophe (C4-B4)
-        # Determine letter case and octave markers
-        letter = name[1] if name.startswith('^') else name[0]  # base letter (A-G)
-        if octave >= base_octave:
-            # Uppercase for octave 4, lowercase for 5 and above
-            abc_letter = letter.upper() if octave == base_octave else letter.lower()
-            if octave > base_octave + 1:  # add apostrophes for octave > 5
-                abc_letter += "'" * (octave - 5)
-        else:
-            # Octave below 4: uppercase with commas
-            abc_letter = letter.upper()
-            abc_letter += "," * (base_octave - octave)
-        # Prepend accidental if needed
-        return ("^" + abc_letter) if name.startswith('^') else abc_letter
-
-    # Helper to identify chord name from a set of pitches
-    def identify_chord(pitches):
-        pcs = sorted({p % 12 for p in pitches})  # unique pitch classes
-        if not pcs:
-            return None
-        # Use lowest note as tentative root
-        root = pcs[0]
-        rel = sorted(((pc - root) % 12) for pc in pcs)  # relative pitches from root
-        # Map root to name (prefer sharps for simplicity)
-        name_map = {0:"C",1:"C#",2:"D",3:"D#",4:"E",5:"F",6:"F#",7:"G",8:"G#",9:"A",10:"A#",11:"B"}
-        root_name = name_map[root]
-        # Recognize common chord intervals
-        intervals = rel[1:]  # skip 0 which is root
-        # Two-note (dyad) – only label power chords (5th)
-        if len(rel) == 2:
-            if rel[1] == 7:
-                return f"{root_name}5"
-            return None
-        # Triads
-        if len(rel) == 3:
-            if intervals == [4,7]:
-                return f"{root_name}maj"
-            if intervals == [3,7]:
-                return f"{root_name}min"
-            if intervals == [3,6]:
-                return f"{root_name}dim"
-            if intervals == [4,8]:
-                return f"{root_name}aug"
-            if intervals == [2,7]:
-                return f"{root_name}sus2"
-            if intervals == [5,7]:
-                return f"{root_name}sus4"
-        # 4-note chords (sevenths, sixths)
-        if len(rel) == 4:
-            if intervals == [4,7,10]:
-                return f"{root_name}7"
-            if intervals == [3,7,10]:
-                return f"{root_name}min7"
-            if intervals == [4,7,11]:
-                return f"{root_name}maj7"
-            if intervals == [3,6,10]:
-                return f"{root_name}min7b5"
-            if intervals == [3,6,9]:
-                return f"{root_name}dim7"
-            if intervals == [4,7,9]:
-                return f"{root_name}6"
-            if intervals == [3,7,9]:
-                return f"{root_name}min6"
-        # For more complex chords (9ths, etc.), or unrecognized patterns, return None
-        return None
+        out(f"Key: {key_text} major\n")
+    out(f"Time Signature: {num}/{den}\n\n")
+    yield buf.getvalue()
 
     # Process each track
     tune_index = 1
@@ -180,7 +241,8 @@ def process_guitar_pro(file_path):
 
         # Identify if track is guitar or bass
         prog = track.channel.instrument  # MIDI instrument program number
-        num_strings = len(track.strings)
+        open_pitches = tuple(s.value for s in track.strings)  # open string MIDI pitches
+        num_strings = len(open_pitches)
         is_guitar = (prog is not None and 24 <= prog <= 31) or (num_strings >= 6)
         is_bass   = (prog is not None and 32 <= prog <= 39) or (4 <= num_strings <= 5)
 
@@ -196,96 +258,90 @@ def process_guitar_pro(file_path):
         track_comments = getattr(track, 'comments', '')
 
         # Track metadata
-        output.append(f"Track: {name} ({instrument})")
+        buf = io.StringIO()
+        out = buf.write
+        out(f"Track: {name} ({instrument})\n")
         if track_description:
-            output.append(f"Description: {track_description}")
+            out(f"Description: {track_description}\n")
         if track_comments:
-            output.append(f"Comments: {track_comments}")
+            out(f"Comments: {track_comments}\n")
 
         # Tuning: list open string notes from low to high
-        tuning_pitches = sorted([s.value for s in track.strings], reverse=True)  # highest string last
-        tuning_names = [ f"{['C','C#','D','D#','E','F','F#','G','G#','A','A#','B'][p%12]}{p//12 - 1}"
-                         for p in tuning_pitches ]
-        output.append("Tuning: " + " ".join(tuning_names))
+        tuning_pitches = sorted(open_pitches, reverse=True)  # highest string last
+        tuning_names = [ f"{_PITCH_NAMES[p%12]}{p//12 - 1}" for p in tuning_pitches ]
+        out("Tuning: " + " ".join(tuning_names) + "\n")
 
-        output.append("ABC Notation:")
+        out("ABC Notation:\n")
         # ABC header for this track
-        output.append(f"X:{tune_index}")
-        output.append(f"T:{song_title}")
+        out(f"X:{tune_index}\n")
+        out(f"T:{song_title}\n")
         if song_subtitles:
             for subtitle in song_subtitles:
-                output.append(f"T:{subtitle}")
-        output.append(f"C:{song_composer if song_composer != 'Unknown Composer' else ''}")
-        output.append(f"A:{song_artist if song_artist != 'Unknown Artist' else ''}")
-        output.append(f"Z:{song_album if song_album != 'Unknown Album' else ''}")
-        output.append(f"N:{name} ({instrument})")
-        output.append(f"M:{num}/{den}")
-        output.append("L:1/16")  # Use 1/16 as base unit for better readability
-        output.append(f"Q:1/4={tempo}")
-        output.append(f"K:{key_text}")
+                out(f"T:{subtitle}\n")
+        out(f"C:{song_composer if song_composer != 'Unknown Composer' else ''}\n")
+        out(f"A:{song_artist if song_artist != 'Unknown Artist' else ''}\n")
+        out(f"Z:{song_album if song_album != 'Unknown Album' else ''}\n")
+        out(f"N:{name} ({instrument})\n")
+        out(f"M:{num}/{den}\n")
+        out("L:1/16\n")  # Use 1/16 as base unit for better readability
+        out(f"Q:1/4={tempo}\n")
+        out(f"K:{key_text}\n")
 
         # Iterate through measures and beats
         measure_count = 0
         current_section = None
 
+        # Measure headers share a class, so probe which optional attributes exist once per track
+        sample = track.measures[0].header if track.measures else None
+        present_attrs = tuple(a for a in _HEADER_TEXT_ATTRS if sample is not None and hasattr(sample, a))
+        has_marker = sample is not None and hasattr(sample, 'marker')
+        has_alternative = sample is not None and hasattr(sample, 'repeatAlternative')
+        has_repeat = sample is not None and hasattr(sample, 'repeat')
+
         for measure in track.measures:
             measure_count += 1
+            header = measure.header
 
             # Check for section markers (text annotations) in measure header
-            if hasattr(measure.header, 'marker') and measure.header.marker:
-                marker = measure.header.marker
+            if has_marker and header.marker:
+                marker = header.marker
                 section_name = marker.title if hasattr(marker, 'title') else str(marker)
                 if section_name:
                     # Add a section marker to the ABC notation
-                    output.append(f"{{SECTION: {section_name}}}")
+                    out(f"{{SECTION: {section_name}}}\n")
                     current_section = section_name
 
             # Check for text annotations that might indicate sections
-            for attr_name in ['text', 'direction', 'annotation', 'comment']:
-                if hasattr(measure.header, attr_name) and getattr(measure.header, attr_name):
-                    text = getattr(measure.header, attr_name)
+            for attr_name in present_attrs:
+                text = getattr(header, attr_name)
+                if text:
                     text_value = text.value if hasattr(text, 'value') else str(text)
                     if text_value and text_value.strip():
                         section_text = text_value.strip()
 
                         # Check for common section names
-                        section_keywords = {
-                            'VERSE': ['verse', 'v1', 'v2', 'v3', 'v4', 'verse 1', 'verse 2'],
-                            'CHORUS': ['chorus', 'ch', 'chor', 'refrain'],
-                            'BRIDGE': ['bridge', 'br', 'middle eight'],
-                            'INTRO': ['intro', 'introduction'],
-                            'OUTRO': ['outro', 'ending', 'coda', 'end'],
-                            'SOLO': ['solo', 'instrumental', 'inst', 'guitar solo', 'bass solo'],
-                            'PRE-CHORUS': ['pre-chorus', 'pre chorus', 'prechorus', 'pre-verse'],
-                            'INTERLUDE': ['interlude', 'break', 'intermezzo'],
-                        }
-
-                        section_type = None
-                        for type_name, keywords in section_keywords.items():
-                            if any(keyword.lower() in section_text.lower() for keyword in keywords):
-                                section_type = type_name
-                                break
+                        section_type = _section_type(section_text)
 
                         if section_type:
-                            output.append(f"{{SECTION: {section_type} - {section_text}}}")
+                            out(f"{{SECTION: {section_type} - {section_text}}}\n")
                         else:
-                            output.append(f"{{TEXT: {section_text}}}")
+                            out(f"{{TEXT: {section_text}}}\n")
 
                         break  # Found text annotation, no need to check others
 
             # Check for measure-specific properties
-            if hasattr(measure.header, 'repeatAlternative') and measure.header.repeatAlternative:
-                alt = measure.header.repeatAlternative
-                output.append(f"{{ALTERNATIVE: {alt}}}")
+            if has_alternative and header.repeatAlternative:
+                alt = header.repeatAlternative
+                out(f"{{ALTERNATIVE: {alt}}}\n")
 
-            if hasattr(measure.header, 'repeat') and measure.header.repeat:
-                rep = measure.header.repeat
+            if has_repeat and header.repeat:
+                rep = header.repeat
                 if hasattr(rep, 'closings') and rep.closings:
-                    output.append(f"{{REPEAT: {rep.closings} times}}")
+                    out(f"{{REPEAT: {rep.closings} times}}\n")
                 elif hasattr(rep, 'close') and rep.close:
-                    output.append(f"{{REPEAT END}}")
+                    out(f"{{REPEAT END}}\n")
                 elif hasattr(rep, 'open') and rep.open:
-                    output.append(f"{{REPEAT START}}")
+                    out(f"{{REPEAT START}}\n")
 
             if not measure.voices:
                 continue
@@ -295,21 +351,15 @@ def process_guitar_pro(file_path):
             bar_content = []  # collect notations for this measure
 
             for beat_idx, beat in enumerate(voice.beats):
+                # Load beat attributes once per beat
+                bdur = beat.duration
+                beff = beat.effect
+                bnotes = beat.notes
+
                 # Check for rest (beat with no notes)
-                if not beat.notes:
+                if not bnotes:
                     # Use 'z' for rest with the beat's duration
-                    dur = beat.duration.value if beat.duration else 4
-                    # IMPROVED DURATION CALCULATION FOR RESTS
-                    length_multiplier = 16 / dur if dur != 0 else 16
-                    if beat.duration and beat.duration.isDotted:
-                        length_multiplier *= 1.5
-
-                    if length_multiplier == 1:
-                        bar_content.append("z")
-                    elif length_multiplier < 1:
-                        bar_content.append(f"z/{int(1/length_multiplier)}")
-                    else:
-                        bar_content.append(f"z{int(length_multiplier)}")
+                    bar_content.append(_fmt_dur("z", bdur))
                     continue
 
                 # Check for beat-level text annotations
@@ -320,12 +370,12 @@ def process_guitar_pro(file_path):
                         bar_content.append(f"\"({text_value})\"")
 
                 # If there are notes, determine if it's a chord or single note
-                if len(beat.notes) > 1:
+                if len(bnotes) > 1:
                     # Chord: get actual pitches for each note (open string pitch + fret value)
                     pitches = []
-                    for note in beat.notes:
-                        if note.string <= len(track.strings):
-                            open_pitch = track.strings[note.string-1].value  # open string MIDI
+                    for note in bnotes:
+                        if note.string <= num_strings:
+                            open_pitch = open_pitches[note.string-1]         # open string MIDI
                             pitch = open_pitch + note.value                  # add fret offset
                             pitches.append(pitch)
 
@@ -339,81 +389,41 @@ def process_guitar_pro(file_path):
                         chord_notes = "".join(midi_to_abc(p) for p in sorted(pitches))
                         chord_repr = f"[{chord_notes}]"
 
-                    # IMPROVED DURATION CALCULATION FOR CHORDS
-                    dur = beat.duration.value if beat.duration else 4
-                    length_multiplier = 16 / dur if dur != 0 else 16
-                    if beat.duration and beat.duration.isDotted:
-                        length_multiplier *= 1.5
-
-                    if length_multiplier == 1:
-                        final_repr = chord_repr
-                    elif length_multiplier < 1:
-                        final_repr = f"{chord_repr}/{int(1/length_multiplier)}"
-                    else:
-                        final_repr = f"{chord_repr}{int(length_multiplier)}"
-
-                    bar_content.append(final_repr)
+                    bar_content.append(_fmt_dur(chord_repr, bdur))
 
                 else:
                     # Single note
-                    note = beat.notes[0]
+                    note = bnotes[0]
 
                     # Calculate pitch
-                    open_pitch = track.strings[note.string-1].value if note.string <= len(track.strings) else 0
+                    open_pitch = open_pitches[note.string-1] if note.string <= num_strings else 0
                     pitch = open_pitch + note.value
                     note_repr = midi_to_abc(pitch)
 
                     # Check for special effects on this note
                     effects = []
-                    if note.effect:
-                        if note.effect.bend is not None:
-                            effects.append("b")
-                        if getattr(note.effect, 'hammer', False):
-                            hammer_type = "ho" if getattr(note.effect, 'isHammerOn', True) else "po"
-                            effects.append(hammer_type)
-                        if note.effect.harmonic is not None:
-                            effects.append("h")
-                        if getattr(note.effect, 'slides', None):
-                            effects.append("s")
-                        if getattr(note.effect, 'vibrato', False):
-                            effects.append("v")
-                        if getattr(note.effect, 'palmMute', False):
-                            effects.append("pm")
-                        if getattr(note.effect, 'staccato', False):
-                            effects.append("st")
-                        if getattr(note.effect, 'tapping', False):
-                            effects.append("t")
-                        if getattr(note.effect, 'tremoloPicking', False):
-                            effects.append("tr")
-
-                    if beat.effect:
+                    eff = note.effect
+                    if eff:
+                        effects = [tag for attr, tag, is_obj in _NOTE_EFFECT_FLAGS
+                                   if (getattr(eff, attr, None) is not None if is_obj
+                                       else getattr(eff, attr, False))]
+                        if "ho" in effects and not getattr(eff, 'isHammerOn', True):
+                            effects[effects.index("ho")] = "po"
+
+                    if beff:
                         # Slide or vibrato might also be recorded at beat level
-                        if getattr(beat.effect, 'tremoloBar', None) or getattr(beat.effect, 'slide', None):
+                        if getattr(beff, 'tremoloBar', None) or getattr(beff, 'slide', None):
                             if "s" not in effects:  # Avoid duplicates
                                 effects.append("s")
-                        if getattr(beat.effect, 'vibrato', False):
+                        if getattr(beff, 'vibrato', False):
                             if "v" not in effects:  # Avoid duplicates
                                 effects.append("v")
 
                     # Append effect markers with separate parentheses for each effect
                     if effects:
-                        for effect in effects:
-                            note_repr += f"({effect})"
-
-                    # IMPROVED DURATION CALCULATION FOR SINGLE NOTES
-                    dur = beat.duration.value if beat.duration else 4
-                    length_multiplier = 16 / dur if dur != 0 else 16
-                    if beat.duration and beat.duration.isDotted:
-                        length_multiplier *= 1.5
-
-                    if length_multiplier == 1:
-                        final_repr = note_repr
-                    elif length_multiplier < 1:
-                        final_repr = f"{note_repr}/{int(1/length_multiplier)}"
-                    else:
-                        final_repr = f"{note_repr}{int(length_multiplier)}"
+                        note_repr += "".join(f"({effect})" for effect in effects)
 
-                    bar_content.append(final_repr)
+                    bar_content.append(_fmt_dur(note_repr, bdur))
 
             # End of measure – join content and add a bar line
 
@@ -421,29 +431,70 @@ def process_guitar_pro(file_path):
             # bar_content.insert(0, f"%{measure_count}")  # Removing measure numbers
 
             # Break long measures into multiple lines for better readability
-            if len(bar_content) > 16:  # Split long measures for readability
-                chunks = [bar_content[i:i+16] for i in range(0, len(bar_content), 16)]
-                for i, chunk in enumerate(chunks):
-                    if i == len(chunks) - 1:  # Last chunk
-                        output.append(" ".join(chunk) + " |")
-                    else:
-                        output.append(" ".join(chunk) + " \\")  # Line continuation
+            n = len(bar_content)
+            if n > 16:  # Split long measures for readability
+                for i in range(0, n, 16):
+                    end = i + 16
+                    out(" ".join(bar_content[i:end]))
+                    # Bar line after the last chunk, line continuation otherwise
+                    out(" |\n" if end >= n else " \\\n")
             else:
-                output.append(" ".join(bar_content) + " |")
+                out(" ".join(bar_content) + " |\n")
 
-        output.append("")  # blank line between tracks
+        out("\n")  # blank line between tracks
         tune_index += 1
+        yield buf.getvalue()
 
-    # Join all lines into one output string
-    result = "\n".join(output)
-    return result
+def process_guitar_pro(file_path):
+    return "".join(stream_guitar_pro(file_path))
 
-import streamlit as st
-import tempfile
-import os
-from openai import OpenAI
-import base64
-# Assuming process_guitar_pro function is defined elsewhere
+# System prompt for the chat, built once per uploaded file
+_SYSTEM_TEMPLATE = """You are a helpful music assistant. 
+
+Here is the ABC notation of the piece to analyze:
+
+{abc}
+
+Analyze this notation and respond to the user's query. Please do NOT reference the syntax or the ABC notation (e.g.: references to chords like [B,,,^F,,]) in your answer, instead describe them with natural language and proper music theory terminology."""
+
+# Collapse runs of rest-only bars into ABC multi-measure rests (Zn) to shrink the
+# notation sent to the API; timing is kept while most of the empty bars disappear
+def _compact_abc(abc):
+    lines = []
+    bar = []  # lines of a bar split with line continuations, read so far
+    rest_bars = 0
+    for line in abc.split("\n"):
+        # A split bar is handled as one unit once its final line has been read
+        bar.append(line)
+        if line.endswith(" \\"):
+            continue
+        group, bar = bar, []
+        if line.endswith("|") and all(_REST_BAR_RE.match(l) for l in group):
+            rest_bars += 1
+            continue
+        if rest_bars:
+            lines.append(f"Z{rest_bars} |")
+            rest_bars = 0
+        lines.extend(group)
+    lines.extend(bar)  # unterminated continuation at the end of the text
+    if rest_bars:
+        lines.append(f"Z{rest_bars} |")
+    return "\n".join(lines)
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl="1h")
+def process_guitar_pro_bytes(file_bytes: bytes) -> str:
+    # guitarpro parses file-like objects directly, so the uploaded bytes are read from
+    # memory; results are cached on the file contents so re-uploading the same file
+    # skips the conversion
+    return process_guitar_pro(io.BytesIO(file_bytes))
+
+# Reuse a single OpenAI client per API key across reruns and sessions; bounded so
+# the keys users enter aren't all held in server memory for the life of the process
+@st.cache_resource(max_entries=32, ttl="1h")
+def get_client(api_key):
+    # Imported lazily so app startup doesn't pay for it until an API key is entered
+    from openai import OpenAI
+    return OpenAI(api_key=api_key)
 
 # Show title and description with wider layout
 st.set_page_config(
@@ -475,6 +526,8 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "abc_notation" not in st.session_state:
     st.session_state.abc_notation = None
+if "system_content" not in st.session_state:
+    st.session_state.system_content = None
 if "file_processed" not in st.session_state:
     st.session_state.file_processed = False
 if "show_abc" not in st.session_state:
@@ -492,9 +545,11 @@ def toggle_abc_view():
 def sanitize_for_api(text):
     # Replace emojis and other problematic characters
     # This is a simple version - you might need more comprehensive handling
-    import re
+    # Plain ASCII text (the common case) is returned as-is without running the regex
+    if text.isascii():
+        return text
     # Replace emoji and other non-ASCII characters with their descriptions or placeholders
-    sanitized = re.sub(r'[^\x00-\x7F]+', '[SYMBOL]', text)
+    sanitized = _NON_ASCII_RE.sub('[SYMBOL]', text)
     return sanitized
 
 # Move API Key Input and file upload to sidebar
@@ -503,7 +558,7 @@ with st.sidebar:
     openai_api_key = st.text_input("OpenAI API Key", type="password")
 
     if openai_api_key:
-        client = OpenAI(api_key=openai_api_key)
+        client = get_client(openai_api_key)
 
         uploaded_file = st.file_uploader(
             "Upload a Guitar Pro file",
@@ -517,21 +572,17 @@ with st.sidebar:
 
 # Process uploaded file
 if openai_api_key and uploaded_file and not st.session_state.file_processed:
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-        tmp_file.write(uploaded_file.getvalue())
-        temp_path = tmp_file.name
-
     try:
         with st.spinner("Converting Guitar Pro file to ABC notation..."):
-            st.session_state.abc_notation = process_guitar_pro(temp_path)
+            st.session_state.abc_notation = process_guitar_pro_bytes(uploaded_file.getvalue())
+            # Include ABC notation in the system message without sanitization
+            st.session_state.system_content = _SYSTEM_TEMPLATE.format(
+                abc=_compact_abc(st.session_state.abc_notation)
+            )
             st.session_state.file_processed = True
             st.success("File converted successfully!")
-
-        os.unlink(temp_path)
     except Exception as e:
         st.error(f"Error processing file: {str(e)}")
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
 
 # Display ABC notation controls and preview AFTER file processing - outside the sidebar
 if st.session_state.file_processed:
@@ -544,27 +595,18 @@ if st.session_state.file_processed:
             toggle_abc_view()
 
     with col2:
-        # Create a button that will copy the ABC notation to clipboard
-        if st.button("Copy ABC to Clipboard"):
-            # Create JavaScript to copy text to clipboard
-            abc_b64 = base64.b64encode(st.session_state.abc_notation.encode()).decode()
-            js_code = f"""
-            <script>
-                const textToCopy = atob("{abc_b64}");
-                const textarea = document.createElement('textarea');
-                textarea.value = textToCopy;
-                document.body.appendChild(textarea);
-                textarea.select();
-                document.execCommand('copy');
-                document.body.removeChild(textarea);
-                // Show feedback
-                alert('ABC notation copied to clipboard!');
-            </script>
-            """
-
-            # Use components to inject JavaScript
-            st.components.v1.html(js_code, height=0)
-            st.success("ABC notation copied to clipboard!")
+        # Use st.code's built-in copy button; very large notation is offered as a
+        # download instead of being embedded in the page
+        if len(st.session_state.abc_notation) <= _MAX_INLINE_ABC:
+            with st.expander("Copy ABC to Clipboard"):
+                st.code(st.session_state.abc_notation, language="text")
+        else:
+            st.download_button(
+                label="Download ABC",
+                data=st.session_state.abc_notation,
+                file_name="score.abc",
+                mime="text/plain"
+            )
 
     # Show ABC notation if view is toggled
     if st.session_state.show_abc:
@@ -572,12 +614,14 @@ if st.session_state.file_processed:
 
     st.markdown("---")  # Divider between ABC controls and chat
 
-# Display chat messages
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+# Chat runs as a fragment so each message only reruns the chat, not the whole page
+@st.fragment
+def chat_fragment(client):
+    # Display chat messages
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
 
-if openai_api_key and st.session_state.file_processed:
     if prompt := st.chat_input("Ask a question about your music:"):
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": prompt})
@@ -591,27 +635,16 @@ if openai_api_key and st.session_state.file_processed:
             message_placeholder = st.empty()
             full_response = ""
 
-            # Include ABC notation in the system message without sanitization
-            system_content = f"""You are a helpful music assistant. 
-
-Here is the ABC notation of the piece to analyze:
-
-{st.session_state.abc_notation}
-
-Analyze this notation and respond to the user's query. Please do NOT reference the syntax or the ABC notation (e.g.: references to chords like [B,,,^F,,]) in your answer, instead describe them with natural language and proper music theory terminology."""
-
-            # Prepare the messages for API call
+            # Prepare the messages for API call: the system message is identical on every
+            # turn so OpenAI's prompt-prefix cache can reuse it, followed by the history
             api_messages = [
                 {
                     "role": "system",
-                    "content": system_content
-                }
+                    "content": st.session_state.system_content
+                },
+                *st.session_state.messages
             ]
 
-            # Add all conversation history
-            for message in st.session_state.messages:
-                api_messages.append(message)
-
             # Generate the response
             with st.spinner("Analyzing music..."):
                 try:
@@ -621,12 +654,21 @@ Analyze this notation and respond to the user's query. Please do NOT reference t
                         stream=True,
                     )
 
-                    # Process the streaming response
+                    # Process the streaming response, re-rendering the placeholder only every
+                    # few chunks or after a short interval rather than on every token
+                    pending_since_flush = 0
+                    last_flush = time.monotonic()
                     for chunk in stream:
                         if chunk.choices[0].delta.content:
                             full_response += chunk.choices[0].delta.content
-                            # Use a simple ASCII character for the cursor instead
-                            message_placeholder.markdown(full_response + "_")
+                            pending_since_flush += 1
+                            now = time.monotonic()
+                            if (pending_since_flush >= _STREAM_FLUSH_CHUNKS
+                                    or now - last_flush > _STREAM_FLUSH_SECONDS):
+                                # Use a simple ASCII character for the cursor instead
+                                message_placeholder.markdown(full_response + "_")
+                                pending_since_flush = 0
+                                last_flush = now
 
                     message_placeholder.markdown(full_response)
                 except Exception as e:
@@ -636,6 +678,8 @@ Analyze this notation and respond to the user's query. Please do NOT reference t
             # Add assistant response to chat history
             st.session_state.messages.append({"role": "assistant", "content": full_response})
 
+if openai_api_key and st.session_state.file_processed:
+    chat_fragment(client)
 elif openai_api_key and not st.session_state.file_processed and uploaded_file:
     st.info("Processing your file. Please wait...")
 elif openai_api_key and not uploaded_file: